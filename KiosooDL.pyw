@@ -6,18 +6,21 @@ import os
 import re
 import subprocess
 import json
+import hashlib
+import shutil
+import time
 import datetime
-import webbrowser
+import functools
 from PyQt5.QtWidgets import (
     QApplication, QWidget, QVBoxLayout, QHBoxLayout, QLabel, QLineEdit,
-    QPushButton, QComboBox, QTextEdit, QProgressBar, QFileDialog, QCheckBox,
+    QPushButton, QComboBox, QTextEdit, QPlainTextEdit, QProgressBar, QFileDialog, QCheckBox,
     QMessageBox, QListWidget, QListWidgetItem, QTabWidget, QInputDialog,
     QAbstractItemView, QSystemTrayIcon, QTableWidget, QTableWidgetItem,
     QHeaderView, QSpinBox, QStyle
 )
 from PyQt5.QtCore import (
     QThread, pyqtSignal, Qt, QSettings, QThreadPool, QRunnable, pyqtSlot, QObject,
-    QSize
+    QSize, QTimer
 )
 from PyQt5.QtGui import QIcon
 
@@ -25,6 +28,8 @@ from PyQt5.QtGui import QIcon
 ORG_NAME = "HiepLV"
 APP_NAME = "KiosooDL"
 APP_VERSION = "2.2" # Version updated for bugfix
+EXTRACT_CACHE_FILE = os.path.join(os.getcwd(), "extract_cache.json")
+EXTRACT_CACHE_TTL = 24 * 60 * 60 # seconds a cached playlist listing stays valid
 
 # --- Dark Theme Stylesheet ---
 DARK_STYLESHEET = """
@@ -45,7 +50,7 @@ QTabBar::tab {
 QTabBar::tab:selected, QTabBar::tab:hover {
     background: #3c3c3c;
 }
-QLineEdit, QTextEdit, QSpinBox {
+QLineEdit, QTextEdit, QPlainTextEdit, QSpinBox {
     background-color: #3c3c3c;
     border: 1px solid #555;
     padding: 5px;
@@ -102,23 +107,101 @@ def get_subprocess_kwargs():
             kwargs["startupinfo"] = si
     return kwargs
 
+def load_extract_cache(key):
+    try:
+        with open(EXTRACT_CACHE_FILE, "r", encoding="utf-8") as f: entry = json.load(f).get(key)
+    except Exception:
+        return None
+    if entry and time.time() - entry.get("time", 0) < EXTRACT_CACHE_TTL:
+        return entry.get("ids")
+    return None
+
+def save_extract_cache(key, ids):
+    try:
+        with open(EXTRACT_CACHE_FILE, "r", encoding="utf-8") as f: cache = json.load(f)
+    except Exception:
+        cache = {}
+    now = time.time()
+    # Drop expired entries so the file doesn't grow forever.
+    cache = {k: v for k, v in cache.items() if now - v.get("time", 0) < EXTRACT_CACHE_TTL}
+    cache[key] = {"time": now, "ids": ids}
+    with open(EXTRACT_CACHE_FILE, "w", encoding="utf-8") as f: json.dump(cache, f)
+
+def parse_percent(line):
+    # Walk back from the last "%" over the number in front of it; no regex needed for the hottest line type.
+    i = line.rfind("%")
+    if i <= 0: return None
+    j = i - 1
+    while j >= 0 and (line[j].isdigit() or line[j] == "."): j -= 1
+    try: pct = float(line[j + 1:i])
+    except ValueError: return None
+    return max(0, min(100, int(pct)))
+
+def open_path(path):
+    if os.name == "nt":
+        os.startfile(path)
+        return
+    # Detach the opener so it neither inherits our fds/stdio nor stays tied to the GUI process.
+    opener = "open" if sys.platform == "darwin" else "xdg-open"
+    subprocess.Popen([opener, path], stdin=subprocess.DEVNULL, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+                     start_new_session=True, close_fds=True)
+
+def iter_output_lines(stream, chunk_size=4096, mark_drained=False):
+    # Read a binary pipe in chunks and split it ourselves; yt-dlp redraws progress with "\r", so both "\r" and "\n" end a line.
+    # With mark_drained, a None is yielded whenever a read came back short, i.e. the pipe is empty and the next line may be a while.
+    fd = stream.fileno(); buf = b""
+    while True:
+        chunk = os.read(fd, chunk_size)
+        if not chunk: break
+        lines = (buf + chunk).replace(b"\r", b"\n").split(b"\n"); buf = lines.pop()
+        for line in lines:
+            if line: yield line.decode("utf-8", "replace")
+        if mark_drained and len(chunk) < chunk_size: yield None
+    if buf: yield buf.decode("utf-8", "replace")
+
 def find_ytdlp_executable():
-    exe_names = ["yt-dlp.exe" if os.name == "nt" else "yt-dlp"]
-    bundled_path = os.path.join(os.getcwd(), exe_names[0])
+    bundled_path = os.path.join(os.getcwd(), "yt-dlp.exe" if os.name == "nt" else "yt-dlp")
     if os.path.exists(bundled_path):
         return bundled_path
-    for name in exe_names:
-        try:
-            cmd = ["where", name] if os.name == "nt" else ["which", name]
-            res = subprocess.run(cmd, capture_output=True, text=True, **get_subprocess_kwargs())
-            if res.returncode == 0 and res.stdout.strip():
-                return name
-        except Exception:
-            pass
-    return "yt-dlp"
+    # shutil.which walks PATH in-process instead of spawning `where`/`which` at startup.
+    return shutil.which("yt-dlp") or "yt-dlp"
 
 YTDLP_CMD = find_ytdlp_executable()
 
+@functools.lru_cache(maxsize=None)
+def ytdlp_supports_progress_template():
+    # Builds older than the option reject it outright ("no such option"), so probe once; cleared after `yt-dlp -U`.
+    try:
+        res = subprocess.run([YTDLP_CMD, "--help"], capture_output=True, text=True, encoding='utf-8', errors='replace', **get_subprocess_kwargs())
+        return "--progress-template" in res.stdout
+    except Exception:
+        return False
+
+# yt-dlp format selectors per quality choice in the UI; anything unknown falls back to audio.
+AUDIO_FORMAT = "bestaudio[ext=m4a]/bestaudio"
+FORMAT_SELECTORS = {
+    "Best": "bestvideo[vcodec^=avc1]+bestaudio[ext=m4a]/bestvideo+bestaudio/best",
+    **{f"{res}p": f"bestvideo[height<={res}][vcodec^=avc1]+bestaudio[ext=m4a]/bestvideo[height<={res}]+bestaudio/best[height<={res}]"
+       for res in (2160, 1440, 1080, 720, 480, 360)},
+}
+
+URL_RE = re.compile(r"^https?://", re.I)
+
+def read_urls_file(path):
+    # One read and a whitespace split handles "\n" and "\r\n" files alike; add_urls_to_queue does the validation.
+    with open(path, "r", encoding="utf-8") as f:
+        return f.read().split()
+
+# Prefix of the progress lines requested through --progress-template.
+PROGRESS_PREFIX = "P:"
+
+# Patterns for parsing yt-dlp output, compiled once rather than per line.
+MERGE_RE = re.compile(r"Merging formats into \"(.*)\"")
+DEST_RE = re.compile(r"\[download\] Destination: (.*)")
+AUDIO_DEST_RE = re.compile(r"\[ExtractAudio\] Destination: (.*)")
+VIDEO_ID_RE = re.compile(r"^[\w-]+$")
+EXTRACTOR_ID_RE = re.compile(r"^\[(?!download\])[\w:]+\] ([\w-]+): Downloading")
+
 # -----------------------
 # Worker Signals
 # -----------------------
@@ -144,6 +227,8 @@ class DownloadWorker(QRunnable):
         self.process = None
         self._is_stopped = False
         self.video_id = self.url # Initialize with URL as fallback
+        self._log_buf = []
+        self._last_flush = time.monotonic()
 
     def stop(self):
         self._is_stopped = True
@@ -153,30 +238,22 @@ class DownloadWorker(QRunnable):
             except Exception:
                 pass
     
-    def get_video_id(self):
-        try:
-            res = subprocess.run([YTDLP_CMD, "--get-id", self.url], capture_output=True, text=True, check=True, **get_subprocess_kwargs())
-            self.video_id = res.stdout.strip()
-        except Exception:
-            # Keep URL as ID if fetching fails
-            self.video_id = self.url
+    def emit_log(self, line, flush=False):
+        # Batch yt-dlp output so the GUI thread gets one signal per ~50 ms / 32 lines instead of one per line.
+        self._log_buf.append(line)
+        if flush or len(self._log_buf) >= 32 or time.monotonic() - self._last_flush > 0.05: self.flush_log()
+
+    def flush_log(self):
+        if self._log_buf: self.signals.log_signal.emit("\n".join(self._log_buf))
+        self._log_buf = []; self._last_flush = time.monotonic()
 
     def run(self):
-        self.get_video_id()
-        self.signals.log_signal.emit(f"▶️ Bắt đầu tải: {self.url}")
+        self.emit_log(f"▶️ Bắt đầu tải: {self.url}", flush=True)
         
         output_format = self.options.get("output_format", "mp4")
         is_audio_only = self.options.get("audio_only", False)
         
-        if is_audio_only:
-            fmt = "bestaudio[ext=m4a]/bestaudio"
-        elif self.quality_key == "Best":
-            fmt = "bestvideo[vcodec^=avc1]+bestaudio[ext=m4a]/bestvideo+bestaudio/best"
-        elif "p" in self.quality_key:
-            res = self.quality_key.replace("p", "")
-            fmt = f"bestvideo[height<={res}][vcodec^=avc1]+bestaudio[ext=m4a]/bestvideo[height<={res}]+bestaudio/best[height<={res}]"
-        else:
-            fmt = "bestaudio[ext=m4a]/bestaudio"
+        fmt = AUDIO_FORMAT if is_audio_only else FORMAT_SELECTORS.get(self.quality_key, AUDIO_FORMAT)
 
         out_template = "%(title)s [%(id)s].%(ext)s"
         if self.options.get("numbering"):
@@ -214,41 +291,57 @@ class DownloadWorker(QRunnable):
         if self.options.get("metadata"): cmd += ["--write-info-json"]
         if self.options.get("sponsorblock"): cmd += ["--sponsorblock-remove", "all"]
         if self.archive_file: cmd += ["--download-archive", self.archive_file]
+        cmd += ["--newline"]
+        # One machine-readable "P:<percent>" line per progress update instead of the human progress bar, where supported.
+        if ytdlp_supports_progress_template(): cmd += ["--progress-template", f"download:{PROGRESS_PREFIX}%(progress._percent_str)s"]
         
         cmd.append(self.url)
 
         final_filepath, title, success = "", "", False
         
         try:
-            self.process = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, text=True, encoding='utf-8', errors='replace', bufsize=1, **get_subprocess_kwargs())
+            self.process = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, **get_subprocess_kwargs())
             
-            for line in self.process.stdout:
+            for line in iter_output_lines(self.process.stdout, mark_drained=True):
                 if self._is_stopped: break
-                self.signals.log_signal.emit(line.strip())
+                # Nothing more to read right now (e.g. yt-dlp is sleeping or retrying): don't hold buffered lines back.
+                if line is None: self.flush_log(); continue
+                if line.startswith(PROGRESS_PREFIX):
+                    pct = parse_percent(line)
+                    if pct is not None: self.signals.progress_signal.emit(self.url, pct)
+                    continue
+                self.emit_log(line.strip())
                 
-                m_progress = re.search(r"\[download\]\s+([\d\.]+)%", line)
-                if m_progress:
-                    self.signals.progress_signal.emit(self.url, int(float(m_progress.group(1))))
+                # Builds without --progress-template print the classic "[download]  42.0% of ..." lines instead.
+                # Only "[download]  42.0% of ..." counts: Destination/"already downloaded" paths may contain "%" too.
+                if line.startswith("[download]") and "%" in line:
+                    rest = line[len("[download]"):].lstrip()
+                    pct = parse_percent(rest.split(None, 1)[0]) if rest[:1].isdigit() else None
+                    if pct is not None: self.signals.progress_signal.emit(self.url, pct)
                 
-                m_merge = re.search(r"Merging formats into \"(.*)\"", line)
+                # Take the video ID from the extractor's own output rather than a separate `--get-id` run.
+                if self.video_id == self.url:
+                    m_id = EXTRACTOR_ID_RE.match(line)
+                    if m_id: self.video_id = m_id.group(1)
+                m_merge = MERGE_RE.search(line)
                 if m_merge: final_filepath = m_merge.group(1)
-                m_dest = re.search(r"\[download\] Destination: (.*)", line)
+                m_dest = DEST_RE.search(line)
                 if m_dest and not final_filepath: final_filepath = m_dest.group(1)
-                m_audio = re.search(r"\[ExtractAudio\] Destination: (.*)", line)
+                m_audio = AUDIO_DEST_RE.search(line)
                 if m_audio: final_filepath = m_audio.group(1)
 
             rc = self.process.wait()
             if self._is_stopped:
-                self.signals.log_signal.emit(f"⛔ Đã dừng: {self.url}")
+                self.emit_log(f"⛔ Đã dừng: {self.url}", flush=True)
             elif rc == 0:
-                self.signals.log_signal.emit(f"✅ Hoàn tất: {self.url}")
+                self.emit_log(f"✅ Hoàn tất: {self.url}", flush=True)
                 self.signals.progress_signal.emit(self.url, 100)
                 success = True
             else:
-                self.signals.log_signal.emit(f"⚠️ Lỗi (mã {rc}) khi tải: {self.url}")
+                self.emit_log(f"⚠️ Lỗi (mã {rc}) khi tải: {self.url}", flush=True)
         
         except Exception as e:
-            self.signals.log_signal.emit(f"❌ Lỗi nghiêm trọng khi tải {self.url}: {e}")
+            self.emit_log(f"❌ Lỗi nghiêm trọng khi tải {self.url}: {e}", flush=True)
         
         title = os.path.splitext(os.path.basename(final_filepath))[0] if final_filepath else self.video_id
         
@@ -280,20 +373,52 @@ class ListFormatsThread(QThread):
 
 class ExtractThread(QThread):
     log_signal = pyqtSignal(str); finished_signal = pyqtSignal(list)
-    def __init__(self, url, save_path, batch_size=50):
-        super().__init__(); self.url = url; self.save_path = save_path; self.batch_size = batch_size
+    def __init__(self, url, save_path, batch_size=50, use_cache=True):
+        super().__init__(); self.url = url; self.save_path = save_path; self.batch_size = batch_size; self.use_cache = use_cache
+    def write_batch(self, part, end):
+        start = end - len(part) + 1; filename = os.path.join(self.save_path, f"playlist_{start}-{end}.txt")
+        with open(filename, "w", encoding="utf-8", buffering=65536) as f: f.writelines(f"https://www.youtube.com/watch?v={vid}\n" for vid in part)
+        self.log_signal.emit(f"✅ Lưu {len(part)} links -> {os.path.basename(filename)}"); return filename
     def run(self):
         self.log_signal.emit("📑 Bắt đầu trích xuất..."); cmd = [YTDLP_CMD, "--flat-playlist", "--get-id", self.url]
+        parts, part, ids, proc = [], [], [], None
+        cache_key = hashlib.sha1(self.url.encode("utf-8")).hexdigest()
+        cached = load_extract_cache(cache_key) if self.use_cache else None
         try:
-            proc = subprocess.run(cmd, capture_output=True, text=True, check=True, **get_subprocess_kwargs()); ids = [line.strip() for line in proc.stdout.splitlines() if line.strip()]
-            if not ids: self.log_signal.emit("⚠️ Không tìm thấy video nào."); self.finished_signal.emit([]); return
-            links = [f"https://www.youtube.com/watch?v={vid}" for vid in ids]; total = len(links); parts = []
-            for i in range(0, total, self.batch_size):
-                part = links[i:i+self.batch_size]; start = i+1; end = i + len(part); filename = os.path.join(self.save_path, f"playlist_{start}-{end}.txt")
-                with open(filename, "w", encoding="utf-8") as f: f.write("\n".join(part))
-                parts.append(filename); self.log_signal.emit(f"✅ Lưu {len(part)} links -> {os.path.basename(filename)}")
+            if cached is not None:
+                self.log_signal.emit(f"♻️ Dùng danh sách đã lưu ({len(cached)} video), không cần gọi yt-dlp."); source = cached
+            else:
+                # Stream IDs as yt-dlp prints them and write each batch file as soon as it fills up.
+                proc = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, text=True, encoding='utf-8', errors='replace', bufsize=1, **get_subprocess_kwargs()); source = proc.stdout
+            for line in source:
+                vid = line.strip()
+                if not vid: continue
+                if not VIDEO_ID_RE.match(vid): self.log_signal.emit(vid); continue
+                part.append(vid); ids.append(vid)
+                if len(part) >= self.batch_size: parts.append(self.write_batch(part, len(ids))); part = []
+            if part: parts.append(self.write_batch(part, len(ids)))
+            if proc:
+                rc = proc.wait()
+                if rc != 0: raise subprocess.CalledProcessError(rc, cmd)
+                if ids:
+                    try: save_extract_cache(cache_key, ids)
+                    except Exception as e: self.log_signal.emit(f"⚠️ Không thể lưu cache trích xuất: {e}")
+            total = len(ids)
+            if not total: self.log_signal.emit("⚠️ Không tìm thấy video nào."); self.finished_signal.emit([]); return
             self.log_signal.emit(f"🔚 Trích xuất hoàn tất. Tổng {total} video."); self.finished_signal.emit(parts)
-        except Exception as e: self.log_signal.emit(f"❌ Lỗi khi extract: {e}"); self.finished_signal.emit([])
+        except Exception as e: self.log_signal.emit(f"❌ Lỗi khi extract: {e}"); self.finished_signal.emit(parts)
+        finally:
+            # If writing a batch failed mid-stream, nobody reads the pipe any more; stop yt-dlp instead of leaving it blocked.
+            if proc and proc.poll() is None: proc.kill(); proc.wait()
+
+class UpdateThread(QThread):
+    log_signal = pyqtSignal(str); finished_signal = pyqtSignal(bool, str) # (ok, output or error)
+    def run(self):
+        try:
+            proc = subprocess.Popen([YTDLP_CMD, "-U"], stdout=subprocess.PIPE, stderr=subprocess.STDOUT, **get_subprocess_kwargs()); lines = []
+            for line in iter_output_lines(proc.stdout): lines.append(line); self.log_signal.emit(line)
+            rc = proc.wait(); self.finished_signal.emit(rc == 0, "\n".join(lines))
+        except Exception as e: self.finished_signal.emit(False, str(e))
 
 # -----------------------
 # Main UI
@@ -306,8 +431,13 @@ class MainWindow(QWidget):
         self.download_queue = []
         self.active_workers = {}
         self.history = []
+        self.update_thread = None
+        self.updating_ytdlp = False
         self.history_file = os.path.join(os.getcwd(), "history.json")
         self.log_path = os.path.join(os.getcwd(), "log.txt")
+        self._log_buffer = []
+        self._log_timer = QTimer(self); self._log_timer.setSingleShot(True); self._log_timer.setInterval(50)
+        self._log_timer.timeout.connect(self.flush_log)
 
         self.init_ui()
         self.load_settings()
@@ -328,7 +458,8 @@ class MainWindow(QWidget):
         self.setup_settings_tab(tabs)
 
         main_layout.addWidget(tabs)
-        self.log_area = QTextEdit(readOnly=True)
+        self.log_area = QPlainTextEdit(readOnly=True)
+        self.log_area.setMaximumBlockCount(2000)
         main_layout.addWidget(QLabel("Log:"))
         main_layout.addWidget(self.log_area)
         
@@ -408,6 +539,7 @@ class MainWindow(QWidget):
         self.btn_extract_browse = QPushButton("Browse..."); self.btn_extract_browse.clicked.connect(self.choose_folder_extract)
         path_layout.addWidget(QLabel("Lưu vào:")); path_layout.addWidget(self.extract_folder_input); path_layout.addWidget(self.btn_extract_browse)
         layout.addLayout(path_layout)
+        self.cb_extract_refresh = QCheckBox("Làm mới (bỏ qua danh sách đã lưu trong 24 giờ)"); layout.addWidget(self.cb_extract_refresh)
         self.btn_extract_do = QPushButton("Trích xuất Links ra .txt"); self.btn_extract_do.clicked.connect(self.on_extract_do_clicked)
         layout.addWidget(self.btn_extract_do)
         layout.addWidget(QLabel("Các file batch đã tạo:")); self.extract_batch_list = QListWidget()
@@ -441,16 +573,16 @@ class MainWindow(QWidget):
         self.spin_concur_downloads = QSpinBox(minimum=1, maximum=10, value=2); concur_layout.addWidget(self.spin_concur_downloads)
         layout.addLayout(concur_layout)
         self.cb_auto_update_check = QCheckBox("Tự động kiểm tra cập nhật yt-dlp khi khởi động"); layout.addWidget(self.cb_auto_update_check)
-        btn_update = QPushButton("Kiểm tra cập nhật yt-dlp ngay"); btn_update.clicked.connect(self.on_update_clicked)
+        self.btn_update = QPushButton("Kiểm tra cập nhật yt-dlp ngay"); self.btn_update.clicked.connect(self.on_update_clicked)
         btn_clear_settings = QPushButton("Xóa cài đặt đã lưu"); btn_clear_settings.clicked.connect(self.clear_settings)
         btn_clear_history = QPushButton("Xóa lịch sử tải xuống"); btn_clear_history.clicked.connect(self.clear_history)
-        for w in [btn_update, btn_clear_settings, btn_clear_history]: layout.addWidget(w)
+        for w in [self.btn_update, btn_clear_settings, btn_clear_history]: layout.addWidget(w)
         layout.addStretch(); tabs.addTab(tab, "Cài đặt")
 
     def on_action_clicked(self):
         urls_text = self.url_input.toPlainText().strip()
         if not urls_text: QMessageBox.warning(self, "Thiếu dữ liệu", "Vui lòng nhập ít nhất một link video."); return
-        urls = [line.strip() for line in urls_text.split('\n') if line.strip()]
+        urls = urls_text.split()
         self.url_input.clear(); self.add_urls_to_queue(urls)
 
     def on_stop_all_clicked(self):
@@ -495,6 +627,12 @@ class MainWindow(QWidget):
                 break
 
     def add_urls_to_queue(self, urls):
+        # Drop non-URLs, repeats and links that are already queued or downloading before they cost a yt-dlp run.
+        pending = {item["url"] for item in self.download_queue}.union(self.active_workers)
+        unique_urls = [u for u in dict.fromkeys(urls) if URL_RE.match(u) and u not in pending]
+        if len(unique_urls) < len(urls): self.log(f"🔁 Bỏ qua {len(urls) - len(unique_urls)} link trùng lặp hoặc không hợp lệ.")
+        urls = unique_urls
+        if not urls: return
         total = len(urls)
         for i, url in enumerate(urls):
             item = {"url": url, "batch_index": i + 1, "batch_total": total}
@@ -504,23 +642,32 @@ class MainWindow(QWidget):
     
     def process_queue(self):
         max_concurrent = self.spin_concur_downloads.value()
+        # QThreadPool defaults to one thread per CPU core; downloads are I/O-bound,
+        # so let the pool run as many workers as the user asked for.
+        if self.thread_pool.maxThreadCount() < max_concurrent: self.thread_pool.setMaxThreadCount(max_concurrent)
+        if len(self.active_workers) >= max_concurrent or not self.download_queue: return
+        # Don't launch yt-dlp while `yt-dlp -U` may be replacing the binary; on_update_finished resumes the queue.
+        if self.updating_ytdlp: self.log("⏳ Đang cập nhật yt-dlp, các lượt tải sẽ bắt đầu sau khi cập nhật xong."); return
+
+        # The options only depend on the UI state, so read them once and share them (read-only) between the workers started below.
+        options = {
+            "numbering": self.cb_number.isChecked(), "subtitle_auto": self.cb_sub_auto.isChecked(),
+            "subtitle_manual": self.cb_sub_manual.isChecked(), "sub_lang": self.sub_lang_combo.currentData(),
+            "thumbnail": self.cb_thumb.isChecked(), "metadata": self.cb_meta.isChecked(),
+            "sponsorblock": self.cb_sponsor.isChecked(), "audio_only": self.cb_audio_only.isChecked(),
+            "output_format": self.format_combo.currentText(),
+        }
+        quality_key = self.quality_combo.currentText()
+        save_path = self.folder_input.text() or os.getcwd()
+        archive_file = os.path.join(save_path, "download_archive.txt")
+        cookies_file = self.cookies_input.text()
+
         while len(self.active_workers) < max_concurrent and self.download_queue:
             url_item = self.download_queue.pop(0)
             url = url_item["url"]
             if url in self.active_workers: continue
 
-            options = {
-                "numbering": self.cb_number.isChecked(), "subtitle_auto": self.cb_sub_auto.isChecked(),
-                "subtitle_manual": self.cb_sub_manual.isChecked(), "sub_lang": self.sub_lang_combo.currentData(),
-                "thumbnail": self.cb_thumb.isChecked(), "metadata": self.cb_meta.isChecked(),
-                "sponsorblock": self.cb_sponsor.isChecked(), "audio_only": self.cb_audio_only.isChecked(),
-                "output_format": self.format_combo.currentText(),
-            }
-            save_path = self.folder_input.text() or os.getcwd()
-            archive_file = os.path.join(save_path, "download_archive.txt")
-            cookies_file = self.cookies_input.text()
-
-            worker = DownloadWorker(url_item, self.quality_combo.currentText(), options, save_path, archive_file, cookies_file)
+            worker = DownloadWorker(url_item, quality_key, options, save_path, archive_file, cookies_file)
             worker.signals.log_signal.connect(self.log)
             worker.signals.progress_signal.connect(self.update_progress)
             worker.signals.finished_signal.connect(self.on_single_download_finished)
@@ -609,11 +756,19 @@ class MainWindow(QWidget):
             if txt_files: self.load_txt_files(txt_files)
 
     def log(self, msg):
-        self.log_area.append(msg)
-        self.log_area.verticalScrollBar().setValue(self.log_area.verticalScrollBar().maximum())
+        # Messages are buffered and written out together by flush_log at most every 50 ms.
+        # Worker messages arrive as batches of lines; keep one entry (and one log.txt timestamp) per line.
+        ts = datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+        self._log_buffer.extend((ts, line) for line in msg.split("\n"))
+        if not self._log_timer.isActive(): self._log_timer.start()
+
+    def flush_log(self):
+        if not self._log_buffer: return
+        entries, self._log_buffer = self._log_buffer, []
+        self.log_area.appendPlainText("\n".join(msg for _, msg in entries))
         try:
             with open(self.log_path, "a", encoding="utf-8", errors='replace') as f:
-                f.write(f"{datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S')} - {msg}\n")
+                f.writelines(f"{ts} - {msg}\n" for ts, msg in entries)
         except: pass
 
     def choose_folder(self):
@@ -629,18 +784,25 @@ class MainWindow(QWidget):
         if folder: self.extract_folder_input.setText(folder)
 
     def on_update_clicked(self, silent=False):
-        self.log("🔄 Kiểm tra cập nhật yt-dlp...")
-        try:
-            res = subprocess.run([YTDLP_CMD, "-U"], capture_output=True, text=True, **get_subprocess_kwargs())
-            output = res.stdout.strip(); self.log(output)
+        # `yt-dlp -U` may download a new binary, so run it off the GUI thread.
+        self.log("🔄 Kiểm tra cập nhật yt-dlp..."); self.btn_update.setEnabled(False); self.updating_ytdlp = True
+        self.update_thread = UpdateThread(); self.update_thread.log_signal.connect(self.log)
+        self.update_thread.finished_signal.connect(lambda ok, output: self.on_update_finished(ok, output, silent)); self.update_thread.start()
+
+    def on_update_finished(self, ok, output, silent):
+        self.btn_update.setEnabled(True); self.updating_ytdlp = False
+        ytdlp_supports_progress_template.cache_clear()
+        self.process_queue()
+        if ok:
             if not silent: QMessageBox.information(self, "Cập nhật", "yt-dlp đã là phiên bản mới nhất." if "is up to date" in output else f"Kết quả cập nhật:\n\n{output}")
-        except Exception as e:
-            self.log(f"❌ Lỗi khi cập nhật: {e}")
-            if not silent: QMessageBox.warning(self, "Lỗi", f"Không thể cập nhật yt-dlp: {e}")
+        else:
+            self.log(f"❌ Lỗi khi cập nhật: {output}")
+            if not silent: QMessageBox.warning(self, "Lỗi", f"Không thể cập nhật yt-dlp: {output}")
 
     def on_list_formats_clicked(self):
         url = self.url_input.toPlainText().strip().split('\n')[0]
         if not url: QMessageBox.warning(self, "Thiếu dữ liệu", "Vui lòng nhập link video."); return
+        if self.updating_ytdlp: self.log("⏳ Đang cập nhật yt-dlp, vui lòng thử lại sau khi cập nhật xong."); return
         self.list_thread = ListFormatsThread(url, self.cookies_input.text())
         self.list_thread.log_signal.connect(self.log); self.list_thread.result_signal.connect(self.on_formats_ready); self.list_thread.start()
     
@@ -655,24 +817,39 @@ class MainWindow(QWidget):
     def on_extract_do_clicked(self):
         url = self.extract_url_input.text().strip(); save_path = self.extract_folder_input.text().strip() or os.getcwd()
         if not url: QMessageBox.warning(self, "Thiếu dữ liệu", "Nhập link kênh/playlist"); return
-        os.makedirs(save_path, exist_ok=True); self.extract_thread = ExtractThread(url, save_path)
+        if self.updating_ytdlp: self.log("⏳ Đang cập nhật yt-dlp, vui lòng thử lại sau khi cập nhật xong."); return
+        os.makedirs(save_path, exist_ok=True); self.extract_thread = ExtractThread(url, save_path, use_cache=not self.cb_extract_refresh.isChecked())
         self.extract_thread.log_signal.connect(self.log); self.extract_thread.finished_signal.connect(self.on_extract_finished); self.extract_thread.start()
 
+    def batch_list_paths(self):
+        return {self.batch_list.item(i).data(Qt.UserRole) for i in range(self.batch_list.count())}
+
     def on_extract_finished(self, generated_files):
-        for f in generated_files:
-            it = QListWidgetItem(os.path.basename(f)); it.setData(Qt.UserRole, f); self.extract_batch_list.addItem(it)
-            if f not in [self.batch_list.item(i).data(Qt.UserRole) for i in range(self.batch_list.count())]:
-                i2 = QListWidgetItem(os.path.basename(f)); i2.setData(Qt.UserRole, f); self.batch_list.addItem(i2)
+        # Suspend repaints so a long list of batch files costs one layout pass instead of one per item.
+        known = self.batch_list_paths()
+        self.extract_batch_list.setUpdatesEnabled(False); self.batch_list.setUpdatesEnabled(False)
+        try:
+            for f in generated_files:
+                it = QListWidgetItem(os.path.basename(f)); it.setData(Qt.UserRole, f); self.extract_batch_list.addItem(it)
+                if f not in known:
+                    i2 = QListWidgetItem(os.path.basename(f)); i2.setData(Qt.UserRole, f); self.batch_list.addItem(i2); known.add(f)
+        finally:
+            self.extract_batch_list.setUpdatesEnabled(True); self.batch_list.setUpdatesEnabled(True)
     
     def on_load_txt_clicked(self):
         files, _ = QFileDialog.getOpenFileNames(self, "Chọn file .txt", "", "Text files (*.txt)")
         if files: self.load_txt_files(files)
 
     def load_txt_files(self, files):
-        for file in files:
-            if file not in [self.batch_list.item(i).data(Qt.UserRole) for i in range(self.batch_list.count())]:
-                item = QListWidgetItem(os.path.basename(file)); item.setData(Qt.UserRole, file); self.batch_list.addItem(item)
-                self.log(f"📂 Đã nạp file batch: {file}")
+        known = self.batch_list_paths()
+        self.batch_list.setUpdatesEnabled(False)
+        try:
+            for file in files:
+                if file not in known:
+                    item = QListWidgetItem(os.path.basename(file)); item.setData(Qt.UserRole, file); self.batch_list.addItem(item); known.add(file)
+                    self.log(f"📂 Đã nạp file batch: {file}")
+        finally:
+            self.batch_list.setUpdatesEnabled(True)
 
     def on_remove_batch_clicked(self):
         for item in self.batch_list.selectedItems(): self.batch_list.takeItem(self.batch_list.row(item))
@@ -680,29 +857,11 @@ class MainWindow(QWidget):
     def on_batch_download_selected(self):
         selected_items = self.batch_list.selectedItems()
         if not selected_items: QMessageBox.warning(self, "Thiếu dữ liệu", "Vui lòng chọn file .txt trong danh sách."); return
-        all_urls = set()
-        for item in selected_items:
-            filepath = item.data(Qt.UserRole)
-            try:
-                with open(filepath, 'r', encoding='utf-8') as f:
-                    urls_in_file = [line.strip() for line in f if line.strip()]
-                    for url in urls_in_file:
-                        all_urls.add(url)
-            except Exception as e: self.log(f"❌ Lỗi khi đọc file {filepath}: {e}")
-        
-        # We need to maintain the order from the file for numbering, a set does not do this.
-        # Let's read them into a list instead.
+        # File order is kept for numbering; add_urls_to_queue drops repeats across files.
         ordered_urls = []
-        seen_urls = set()
         for item in selected_items:
             filepath = item.data(Qt.UserRole)
-            try:
-                with open(filepath, 'r', encoding='utf-8') as f:
-                    for line in f:
-                        url = line.strip()
-                        if url and url not in seen_urls:
-                            ordered_urls.append(url)
-                            seen_urls.add(url)
+            try: ordered_urls += read_urls_file(filepath)
             except Exception as e: self.log(f"❌ Lỗi khi đọc file {filepath}: {e}")
             
         if ordered_urls: self.add_urls_to_queue(ordered_urls)
@@ -717,13 +876,20 @@ class MainWindow(QWidget):
         menu = self.history_table.createStandardContextMenu()
         filepath = self.history_table.item(row, 3).text(); url = self.history_table.item(row, 4).text()
         if filepath and os.path.exists(filepath):
-            menu.addAction("Mở file").triggered.connect(lambda: webbrowser.open(f"file:///{filepath}"))
-            menu.addAction("Mở thư mục chứa file").triggered.connect(lambda: webbrowser.open(f"file:///{os.path.dirname(filepath)}"))
+            menu.addAction("Mở file").triggered.connect(lambda: self.open_history_path(filepath))
+            menu.addAction("Mở thư mục chứa file").triggered.connect(lambda: self.open_history_path(os.path.dirname(filepath)))
         if url: menu.addAction("Sao chép URL").triggered.connect(lambda: QApplication.clipboard().setText(url))
         menu.exec_(self.history_table.mapToGlobal(pos))
     
+    def open_history_path(self, path):
+        # A missing xdg-open or an unassociated file type raises here; don't let it escape the slot and abort the app.
+        try: open_path(path)
+        except Exception as e: self.log(f"❌ Không thể mở {path}: {e}")
+
     def closeEvent(self, event):
-        self.on_stop_all_clicked(); self.thread_pool.waitForDone(); self.save_settings(); event.accept()
+        self.on_stop_all_clicked(); self.thread_pool.waitForDone()
+        if self.update_thread: self.update_thread.wait() # don't exit while yt-dlp may be replacing itself
+        self.flush_log(); self.save_settings(); event.accept()
 
 # -----------------------
 # Entry point